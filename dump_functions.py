@@ -1,111 +1,141 @@
 """Functions for creating nodes.dmp and names.dmp files in NCBI format."""
 
+from typing import Dict, Tuple
+
 import numpy as np
 import pandas as pd
 from ete3 import NCBITaxa
 
+# Standard NCBI ranks written to the dump files
+RANK_ORDER = ["kingdom", "phylum", "class", "order", "family", "genus", "species"]
+
+# Buffer size for streaming dump files to disk
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Bound line templates, formatted once per written line
+NAMES_LINE = "{}\t|\t{}\t|\t\t|\tscientific name\n".format
+NODES_LINE = "{}\t|\t{}\t|\t{}\t|\n".format
+
 
 def impute_taxons(taxon_df: pd.DataFrame) -> pd.DataFrame:
     """
     Replace nan values in taxon dataframe with
     unknown1, unknown2, ...
     """
-    # Ensure we are working with a copy to avoid SettingWithCopyWarning
-    taxon_df = taxon_df.copy()
-    taxon_df = taxon_df.replace('unknown_rank_name', None)
-    row, col = np.where(pd.isnull(taxon_df) == True)
-    i = 1
-    for r, c in zip(row, col):
-        # Use .iloc for setting values
-        taxon_df.iloc[r, c] = "unknown" + str(i)
-        i += 1
-    return taxon_df
-
-
-def getTaxIDFromNCBI(taxa: str, ncbi_instance: NCBITaxa) -> str:
+    taxon_df = taxon_df.replace('unknown_rank_name', np.nan)
+    vals = taxon_df.to_numpy(dtype=object, copy=True)
+    mask = pd.isna(vals)
+    # Boolean assignment fills in row-major order, numbering row by row
+    labels = np.char.add("unknown", np.arange(1, mask.sum() + 1).astype(str))
+    vals[mask] = labels.astype(object)
+    return pd.DataFrame(vals, columns=taxon_df.columns, index=taxon_df.index)
+
+
+def build_taxid_map(speciesSorted: pd.DataFrame, ncbi_instance: NCBITaxa) -> Dict[str, str]:
+    """
+    Resolve every unique taxon name in the dump rank columns to its
+    NCBI tax ID with a single get_name_translator query.
+    Names without a tax ID are left out of the map.
+    """
+    ranks = [rank for rank in RANK_ORDER if rank in speciesSorted.columns]
+    all_names = pd.unique(speciesSorted[ranks].values.ravel())
+    all_names = [name for name in all_names if pd.notna(name)]
+    translator = ncbi_instance.get_name_translator(all_names)
+    for name in all_names:
+        if name not in translator:
+            print(f"Warning: NCBI: Unable to match tax ID for '{name}'")
+    return {name: str(ids[0]) for name, ids in translator.items()}
+
+
+def find_rank_changes(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Return NCBI tax ID given the name of the taxon using a pre-initialized NCBITaxa instance.
-    If the NCBI tax ID does not exist for that taxon
-    then return the name of the taxon itself.
+    Return the (row, column) indices of the cells in a 2D array of
+    rank codes that differ from the cell above; the first row is
+    reported in full. Indices come back in row-major order.
     """
-    taxid = ncbi_instance.get_name_translator([taxa])
-    if taxid:
-        return str(list(taxid.values())[0][0])
-    else:
-        print(f"Warning: NCBI: Unable to match tax ID for '{taxa}'")
-        return taxa
+    diffs = np.ones(codes.shape, dtype=bool)
+    diffs[1:] = codes[1:] != codes[:-1]
+    return np.nonzero(diffs)
 
 
-def create_names_dump(speciesSorted: pd.DataFrame, ncbi_instance: NCBITaxa, output_filepath: str) -> None:
+def create_names_dump(speciesSorted: pd.DataFrame, taxid_map: Dict[str, str], output_filepath: str) -> None:
     """
-    Create a names.dmp file.
+    Create a names.dmp file, using taxid_map from build_taxid_map
+    to look up tax IDs.
     """
 
     def write_line(level, name):
-        tax_id = getTaxIDFromNCBI(name, ncbi_instance)
+        tax_id = taxid_map.get(name, name)
         scientific_name_entry = f"{level[0]}__{name}" if name != "root" else "root"
-        return f"{tax_id}\t|\t{scientific_name_entry}\t|\t\t|\tscientific name\n"
-    
-    rank_order = ["kingdom", "phylum", "class", "order", "family", "genus", "species"]
-    lines = []
-
-    # Add root entry
-    lines.append("1\t|\troot\t|\t\t|\tscientific name\n")
+        return NAMES_LINE(tax_id, scientific_name_entry)
 
-    first_entry = speciesSorted.iloc[0]
-    for level in rank_order:
-        lines.append(write_line(level[0], first_entry[level]))
+    arr = speciesSorted[RANK_ORDER].to_numpy(dtype=object)
+    codes = np.column_stack([speciesSorted[rank].astype("category").cat.codes.to_numpy() for rank in RANK_ORDER])
+    rows, cols = find_rank_changes(codes)
 
-    previous = first_entry
-    for _, row in speciesSorted.iloc[1:].iterrows():
-        for level in rank_order:
-            if row[level] != previous[level]:
-                lines.append(write_line(level[0], row[level]))
-        previous = row
+    # Missing ranks (code -1) have no taxon to write, as in nodes.dmp
+    present = codes[rows, cols] >= 0
+    if not present.all():
+        print(f"Warning: Skipped {np.count_nonzero(~present)} missing rank entries in names.dmp; use --impute to fill them.")
+        rows, cols = rows[present], cols[present]
 
-    with open(output_filepath, "w") as outfile:
-        outfile.writelines(lines)
+    # Stream lines straight into a large write buffer
+    with open(output_filepath, "wb", buffering=WRITE_BUFFER_SIZE) as outfile:
+        # Add root entry
+        outfile.write(b"1\t|\troot\t|\t\t|\tscientific name\n")
+        for r, c in zip(rows, cols):
+            outfile.write(write_line(RANK_ORDER[c][0], arr[r, c]).encode("utf-8"))
 
 
-def create_nodes_dump(speciesSorted: pd.DataFrame, ncbi_instance: NCBITaxa, output_filepath: str) -> None:
+def create_nodes_dump(speciesSorted: pd.DataFrame, taxid_map: Dict[str, str], output_filepath: str) -> None:
     """
-    Create a nodes.dmp file.
+    Create a nodes.dmp file, using taxid_map from build_taxid_map
+    to look up tax IDs.
     """
 
-    def write_line(child, parent, rank):
-         child_id = getTaxIDFromNCBI(child, ncbi_instance)
-         parent_id = getTaxIDFromNCBI(parent, ncbi_instance) if parent != "root" else "1"
+    # Ensure rank columns exist
+    available_ranks = [rank for rank in RANK_ORDER if rank in speciesSorted.columns]
+
+    def write_line(child_id, parent_id, rank):
          # Ensure rank is lowercase as per convention seen in NCBI files
          formatted_rank = rank.lower() if rank else "no rank"
-         return f"{child_id}\t|\t{parent_id}\t|\t{formatted_rank}\t|\n"
-
-    # Define the standard NCBI rank order, ensure columns exist
-    rank_order = ["kingdom", "phylum", "class", "order", "family", "genus", "species"]
-    available_ranks = [rank for rank in rank_order if rank in speciesSorted.columns]
-
-    lines = []
-    # Add root entry
-    lines.append("1\t|\t1\t|\tno rank\t|\n")
-
-    # Use a set to keep track of written parent-child relationships to avoid duplicates
-    written_nodes = {("1", "1")}
-
-    for _, row in speciesSorted.iterrows():
-        parent = "root"
-        for rank in available_ranks:
-            child = row[rank]
-            if pd.notna(child): # Ensure child is not NaN
-                child_id = getTaxIDFromNCBI(child, ncbi_instance)
-                parent_id = getTaxIDFromNCBI(parent, ncbi_instance) if parent != "root" else "1"
-
-                node_pair = (child_id, parent_id)
-                if node_pair not in written_nodes:
-                    lines.append(write_line(child, parent, rank))
-                    written_nodes.add(node_pair)
-                parent = child # Current child becomes parent for the next level
-            else:
-                # If a rank is missing, stop processing lower ranks for this row
-                break
-        
-    with open(output_filepath, "w") as outfile:
-        outfile.writelines(lines)
+         return NODES_LINE(child_id, parent_id, formatted_rank)
+
+    # Factorize names across all ranks at once so codes are shared between
+    # columns; -1 marks a missing name
+    values = speciesSorted[available_ranks].to_numpy(dtype=object)
+    name_codes, names = pd.factorize(values.ravel())
+    name_codes = name_codes.reshape(values.shape)
+
+    # Map each unique name to a tax ID code (slot 0 is root), so edges are
+    # deduplicated on tax IDs rather than on names
+    id_codes, tax_ids = pd.factorize(np.array(["1"] + [taxid_map.get(name, name) for name in names], dtype=object))
+    root_code = id_codes[0]
+    lineage_codes = id_codes[np.column_stack([np.zeros(len(values), dtype=np.intp), name_codes + 1])]
+
+    # If a rank is missing, lower ranks of that row are not linked
+    present = np.logical_and.accumulate(name_codes >= 0, axis=1)
+    levels = np.broadcast_to(np.arange(len(available_ranks)), present.shape)
+
+    # (child, parent) pairs in row-major order, behind the root's own pair,
+    # each packed into a single int64 as child * base + parent
+    base = np.int64(len(tax_ids))
+    child_codes = np.concatenate([[root_code], lineage_codes[:, 1:][present]]).astype(np.int64)
+    parent_codes = np.concatenate([[root_code], lineage_codes[:, :-1][present]]).astype(np.int64)
+    packed = child_codes * base + parent_codes
+    pair_levels = levels[present]
+
+    # Keep the first occurrence of each pair, in original order; index 0 is
+    # the root entry, which is written up front
+    _, first = np.unique(packed, return_index=True)
+    first = np.sort(first[first > 0])
+
+    # Stream lines straight into a large write buffer
+    with open(output_filepath, "wb", buffering=WRITE_BUFFER_SIZE) as outfile:
+        # Add root entry
+        outfile.write(b"1\t|\t1\t|\tno rank\t|\n")
+
+        for k in first:
+            child_code, parent_code = divmod(packed[k], base)
+            rank = available_ranks[pair_levels[k - 1]]
+            outfile.write(write_line(tax_ids[child_code], tax_ids[parent_code], rank).encode("utf-8"))
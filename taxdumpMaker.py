@@ -1,21 +1,36 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from ete3 import NCBITaxa
 import os
+import sqlite3
 import sys
 from typing import List, Dict, Optional
 
 # Assuming dump_functions.py is in the same directory or accessible via PYTHONPATH
-from dump_functions import impute_taxons, create_names_dump, create_nodes_dump
+from dump_functions import impute_taxons, build_taxid_map, create_names_dump, create_nodes_dump
 
 # Define standard rank order
 RANK_ORDER = ["no rank", "domain", "kingdom", "phylum", "class", "order", "family", "genus", "species"]
 
+# SQLite settings applied to the NCBI taxonomy connection: 64 MB page cache,
+# 256 MB memory-mapped I/O and in-memory temp storage
+SQLITE_PRAGMAS = "PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456; PRAGMA temp_store=MEMORY;"
+
+def tune_ncbi_connection(ncbi: NCBITaxa) -> None:
+    """Configures the NCBITaxa SQLite connection for fast repeated reads."""
+    try:
+        ncbi.db.executescript(SQLITE_PRAGMAS)
+    except (AttributeError, sqlite3.Error) as e:
+        print(f"Warning: Could not tune NCBI Taxonomy database connection: {e}")
+
 def read_species_list(filepath: str) -> List[str]:
-    """Reads a list of species names from a file."""
+    """Reads a list of unique species names from a file."""
     try:
         with open(filepath, "r") as f:
-            speciesList = [line.strip() for line in f if line.strip()] # Ignore empty lines
+            # Ignore empty lines and drop duplicate names, keeping first-seen order
+            speciesList = list(dict.fromkeys(name for name in map(str.strip, f) if name))
         if not speciesList:
             print(f"Error: Species list file '{filepath}' is empty.")
             sys.exit(1)
@@ -31,10 +46,9 @@ def get_taxonomy_data(speciesList: List[str], ncbi: NCBITaxa) -> Optional[pd.Dat
     """Fetches and processes taxonomy data for the given species list."""
     print("Fetching TaxIDs...")
     name_translator = ncbi.get_name_translator(speciesList)
-    tax_ids_dict = dict(name_translator.items()) # Convert to dict for easier processing
 
     # Identify species not found
-    found_species = set(tax_ids_dict.keys())
+    found_species = set(name_translator)
     not_found_species = [sp for sp in speciesList if sp not in found_species]
     if not_found_species:
         print("\nWarning: The following species were not found in the NCBI database:")
@@ -42,36 +56,46 @@ def get_taxonomy_data(speciesList: List[str], ncbi: NCBITaxa) -> Optional[pd.Dat
             print(f"- {sp}")
         print("-" * 20) # Separator
 
-    if not tax_ids_dict:
+    if not name_translator:
         print("Error: No TaxIDs found for any species in the list.")
         return None
 
-    tax_ids = [item[0] for item in tax_ids_dict.values()] # Extract the first ID if multiple exist
+    tax_ids = [item[0] for item in name_translator.values()] # Extract the first ID if multiple exist
 
     print("Fetching lineages and ranks...")
-    dflist = []
+    lineages = {}
     for tax_id in tax_ids:
         try:
-            lineage = ncbi.get_lineage(tax_id)
-            ranks = ncbi.get_rank(lineage)
-            # Translate taxids in ranks dict to names
-            translated_ranks = {ncbi.get_taxid_translator([k]).get(k, 'unknown_rank_name'): v for k, v in ranks.items()}
-            # Invert dict: {rank: name}
-            rank_to_name = {v: k for k, v in translated_ranks.items()}
-            dflist.append(rank_to_name)
+            lineages[tax_id] = ncbi.get_lineage(tax_id)
         except Exception as e:
             species_name = ncbi.get_taxid_translator([tax_id]).get(tax_id, f"TaxID {tax_id}")
             print(f"Warning: Could not process lineage/ranks for {species_name}: {e}")
 
+    # Resolve ranks and names for every taxon in all lineages at once
+    all_ids = list(set().union(*lineages.values()))
+    all_ranks = ncbi.get_rank(all_ids) if all_ids else {}
+    names_map = ncbi.get_taxid_translator(all_ids) if all_ids else {}
+
+    # Visit lineage members in get_rank's result order, so that when a rank
+    # occurs more than once (e.g. "no rank") the same name wins as with
+    # per-species get_rank calls
+    rank_position = {k: i for i, k in enumerate(all_ranks)}
+
+    dflist = []
+    for lineage in lineages.values():
+        members = sorted((k for k in lineage if k in rank_position), key=rank_position.__getitem__)
+        # Build {rank: name} directly from the bulk lookups
+        rank_to_name = {all_ranks[k]: names_map.get(k, 'unknown_rank_name') for k in members}
+        dflist.append(rank_to_name)
+
     if not dflist:
         print("Error: Failed to retrieve rank information for all found species.")
         return None
 
-    df = pd.DataFrame(dflist)
-
-    # Reorder columns based on standard rank order
-    ordered_columns = [col for col in RANK_ORDER if col in df.columns]
-    df = df[ordered_columns]
+    # Align rows to the standard rank order up front, then drop ranks
+    # that no species has
+    rows = [[rank_to_name.get(rank) for rank in RANK_ORDER] for rank_to_name in dflist]
+    df = pd.DataFrame.from_records(rows, columns=RANK_ORDER).dropna(axis=1, how='all')
 
     return df
 
@@ -82,10 +106,19 @@ def sort_taxonomy_data(df: pd.DataFrame) -> pd.DataFrame:
         print("Warning: Cannot sort DataFrame as no standard rank columns are present.")
         return df
     print("Sorting taxonomy data...")
-    # Use Categorical for robust sorting even with NaNs or mixed types if necessary
-    # For now, standard sort_values should work if data is consistent
+    # Categorical ranks sort and compare on integer codes instead of strings;
+    # the default lexical category order keeps the same row order
+    df = df.copy()
+    for col in sort_columns:
+        df[col] = df[col].astype("category")
     try:
-        sorted_df = df.sort_values(by=sort_columns)
+        keys = []
+        # np.lexsort treats the last key as primary, so stack keys in reverse
+        for col in reversed(sort_columns):
+            codes = df[col].cat.codes.to_numpy()
+            # Missing values (code -1) sort last, as with sort_values
+            keys.append(np.where(codes < 0, len(df[col].cat.categories), codes))
+        sorted_df = df.iloc[np.lexsort(keys)]
     except Exception as e:
         print(f"Warning: Could not sort DataFrame by ranks: {e}. Returning unsorted.")
         return df
@@ -119,6 +152,7 @@ def main():
     except Exception as e:
         print(f"Error initializing or updating NCBI Taxonomy database: {e}")
         sys.exit(1)
+    tune_ncbi_connection(ncbi)
 
     species_list = read_species_list(args.species_list)
     taxonomy_df = get_taxonomy_data(species_list, ncbi)
@@ -138,12 +172,26 @@ def main():
     names_dump_path = os.path.join(args.output_dir, "names.dmp")
     nodes_dump_path = os.path.join(args.output_dir, "nodes.dmp")
 
-    # Create taxdump files
-    print(f"Creating names dump file: {names_dump_path}")
-    create_names_dump(sorted_taxonomy_df, ncbi, names_dump_path)
-
-    print(f"Creating nodes dump file: {nodes_dump_path}")
-    create_nodes_dump(sorted_taxonomy_df, ncbi, nodes_dump_path)
+    # Resolve tax IDs once for both dumps
+    print("Resolving tax IDs for dump files...")
+    taxid_map = build_taxid_map(sorted_taxonomy_df, ncbi)
+
+    # Create taxdump files; they are independent, so write them concurrently
+    print(f"Creating dump files: {names_dump_path}, {nodes_dump_path}")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(create_names_dump, sorted_taxonomy_df, taxid_map, names_dump_path),
+            executor.submit(create_nodes_dump, sorted_taxonomy_df, taxid_map, nodes_dump_path),
+        ]
+        errors = [future.exception() for future in futures]
+    failed = [e for e in errors if e is not None]
+    if failed:
+        # Don't leave one dump file without its counterpart
+        for path in (names_dump_path, nodes_dump_path):
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"Error: Could not create taxdump files: {failed[0]!r}")
+        sys.exit(1)
 
     print("\nTaxdump files generated successfully.")
     print(f"Output directory: {args.output_dir}")